@@ -3,6 +3,9 @@ Agent Configuration
 Define different agents with different personalities, capabilities, and LLM models
 """
 
+from functools import lru_cache
+from types import MappingProxyType
+
 AGENTS = {
     "general": {
         "name": "General Assistant",
@@ -80,20 +83,34 @@ AGENTS = {
 # Default agent if none specified
 DEFAULT_AGENT = "general"
 
+# Model tiers used by complexity routing, ordered fast -> balanced -> powerful.
+# Models outside these ladders (e.g. agent-coder) are never rerouted.
+MODEL_TIERS = [
+    ["agent-fast", "agent-balanced", "agent-powerful"],
+    ["agent-cloud-fast", "agent-cloud-balanced", "agent-cloud-powerful"],
+]
+
+@lru_cache(maxsize=32)
 def get_agent_config(agent_type=None):
-    """Get configuration for a specific agent type"""
+    """
+    Get configuration for a specific agent type.
+    Returns the same read-only mapping on every call, so callers must not mutate it.
+    """
     if agent_type is None or agent_type not in AGENTS:
         agent_type = DEFAULT_AGENT
-    return AGENTS[agent_type]
+    return MappingProxyType(AGENTS[agent_type])
+
+# AGENTS is static, so the public listing is built once at import
+_AGENT_LIST = tuple(
+    {
+        "type": agent_type,
+        "name": config["name"],
+        "model": config["model"],
+        "description": config["description"]
+    }
+    for agent_type, config in AGENTS.items()
+)
 
 def list_agents():
-    """List all available agents"""
-    return [
-        {
-            "type": agent_type,
-            "name": config["name"],
-            "model": config["model"],
-            "description": config["description"]
-        }
-        for agent_type, config in AGENTS.items()
-    ]
+    """List all available agents (shared, treat as read-only)"""
+    return _AGENT_LIST
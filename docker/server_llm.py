@@ -4,31 +4,83 @@ Enhanced Flask server with multi-LLM support via LiteLLM
 Supports multiple agents with different models (local and cloud)
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import anthropic
 from anthropic.types import TextBlock
 import os
+import re
+import math
+import json
+import hashlib
+import threading
+import queue
+import time
+from concurrent.futures import Future
+import orjson
+import httpx
+from collections import OrderedDict
 from dotenv import load_dotenv
 from openai import OpenAI
-from agents_config import get_agent_config, list_agents, DEFAULT_AGENT
+from agents_config import AGENTS, get_agent_config, list_agents, DEFAULT_AGENT, MODEL_TIERS
 
 # Load environment variables
 load_dotenv()
 
+# Werkzeug debugger/reloader only when explicitly requested
+DEBUG = os.environ.get("FLASK_DEBUG") == "1"
+
+# Claude model for direct Anthropic calls (summaries and LiteLLM fallback)
+DEFAULT_FALLBACK_MODEL = os.environ.get("FALLBACK_CLAUDE_MODEL", "claude-3-haiku-20240307")
+
+# Base system prompt per agent, resolved once instead of per request
+SYSTEM_PROMPTS = {agent_type: config["system_prompt"] for agent_type, config in AGENTS.items()}
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson; responses are encoded straight to bytes"""
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # ===================================
 # LLM Client Setup
 # ===================================
 
+# Local alias: an identity check on the exact class skips isinstance's MRO walk
+_TextBlock = TextBlock
+
+# Shared connection pool for every LLM client, so concurrent requests reuse
+# keep-alive sockets (and HTTP/2 streams where the upstream supports it)
+http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    timeout=60.0
+)
+
 # LiteLLM client (OpenAI-compatible)
 litellm_client = None
 if os.environ.get("LITELLM_BASE_URL"):
     litellm_client = OpenAI(
         base_url=os.environ.get("LITELLM_BASE_URL"),
-        api_key="sk-1234"  # Dummy key for LiteLLM
+        api_key="sk-1234",  # Dummy key for LiteLLM
+        http_client=http_client
     )
     print("✅ LiteLLM client configured")
 
@@ -36,16 +88,211 @@ if os.environ.get("LITELLM_BASE_URL"):
 anthropic_client = None
 if os.environ.get("ANTHROPIC_API_KEY"):
     anthropic_client = anthropic.Anthropic(
-        api_key=os.environ.get("ANTHROPIC_API_KEY")
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        http_client=http_client
     )
     print("✅ Anthropic client configured")
 
+# ===================================
+# Request Batching
+# ===================================
+
+class BatchDispatcher:
+    """
+    Coalesces LiteLLM completion calls per model. Calls arriving within
+    `window` seconds of the first one (up to max_batch) are released to the
+    router together, so a batching backend (vLLM, Ollama) sees them as one
+    burst instead of a trickle. Each caller still gets its own response.
+    """
+
+    def __init__(self, client, window=0.01, max_batch=8):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model, **kwargs):
+        """Queue a chat.completions.create call; returns a Future for its response"""
+        future = Future()
+        self._queue_for(model).put((kwargs, future))
+        return future
+
+    def _queue_for(self, model):
+        with self._lock:
+            model_queue = self._queues.get(model)
+            if model_queue is None:
+                model_queue = queue.Queue()
+                self._queues[model] = model_queue
+                threading.Thread(target=self._drain, args=(model, model_queue), daemon=True).start()
+            return model_queue
+
+    def _drain(self, model, model_queue):
+        while True:
+            batch = [model_queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(model_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Fire the whole batch at once
+            for kwargs, future in batch:
+                threading.Thread(target=self._call, args=(model, kwargs, future), daemon=True).start()
+
+    def _call(self, model, kwargs, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self.client.chat.completions.create(model=model, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+# Off unless LITELLM_BATCH_WINDOW_MS is set: the window adds up to that much
+# latency per call, which only pays off under concurrent load
+litellm_dispatcher = None
+batch_window_ms = float(os.environ.get("LITELLM_BATCH_WINDOW_MS", "0"))
+if litellm_client and batch_window_ms > 0:
+    litellm_dispatcher = BatchDispatcher(litellm_client, window=batch_window_ms / 1000)
+
+# ===================================
+# Summary Cache
+# ===================================
+
+class SummaryCache:
+    """
+    In-memory LRU cache of topic summaries, keyed by a hash of the selected
+    text and parent messages. Cache hits skip the summary LLM call entirely.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(parent_messages, selected_text):
+        """Hash the summary inputs into a stable cache key"""
+        payload = json.dumps(
+            [selected_text, [(msg.get('sender'), msg.get('text')) for msg in parent_messages]],
+            sort_keys=True
+        )
+        return hashlib.blake2b(payload.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+            return summary
+
+    def put(self, key, summary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+summary_cache = SummaryCache(maxsize=512)
+
 # ===================================
 # Helper Functions
 # ===================================
 
-def call_litellm(model, messages, system_prompt=None, temperature=0.7, max_tokens=2048):
-    """Call LiteLLM router with OpenAI-compatible API"""
+# Most recent parent messages fed to the topic summarizer
+SUMMARY_MAX_MESSAGES = 12
+
+def read_json_body():
+    """
+    Parse the request body with orjson, reading the stream once without caching it.
+    Empty, malformed or non-object bodies give {}, like get_json(silent=True).
+    """
+    raw = request.get_data(cache=False)
+    if not raw:
+        return {}
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+class InvalidHistory(ValueError):
+    """A message history in the deduplicated encoding that doesn't decode"""
+
+def decode_history(payload):
+    """
+    Expand a message history sent in the deduplicated wire encoding
+    {"msgIndex": [unique messages], "msgSequence": [indexes into msgIndex]}.
+    Plain message lists are returned as-is. A malformed encoding raises InvalidHistory.
+    """
+    if isinstance(payload, dict) and 'msgIndex' in payload:
+        index = payload['msgIndex']
+        sequence = payload.get('msgSequence', [])
+        if not isinstance(index, list) or not isinstance(sequence, list):
+            raise InvalidHistory("msgIndex and msgSequence must be lists")
+        size = len(index)
+        if not all(type(i) is int and 0 <= i < size for i in sequence):
+            raise InvalidHistory("msgSequence entries must be indexes into msgIndex")
+        return [index[i] for i in sequence]
+    return payload or []
+
+# Character budgets (~4 chars per token) for context sent to the model
+RECENT_TURNS_MAX_CHARS = 8000
+PARENT_MESSAGES_MAX_CHARS = 6000
+
+def _keep_newest(items, sizes, max_chars):
+    """Keep the newest items whose sizes (given newest first) fit in max_chars; always keep one"""
+    kept = 0
+    used = 0
+    for size in sizes:
+        used += size
+        if used > max_chars and kept:
+            break
+        kept += 1
+    dropped = len(items) - kept
+    if dropped:
+        app.logger.debug("Dropped %d of %d items over the %d-char context budget", dropped, len(items), max_chars)
+    return items[dropped:]
+
+def budget_turns(turns, max_chars=RECENT_TURNS_MAX_CHARS):
+    """Trim working-memory turns, oldest first, to a character budget"""
+    sizes = (len(turn.get('user') or '') + len(turn.get('assistant') or '') for turn in reversed(turns))
+    return _keep_newest(turns, sizes, max_chars)
+
+def budget_messages(messages, max_chars=PARENT_MESSAGES_MAX_CHARS):
+    """Trim messages, oldest first, to a character budget"""
+    sizes = (len(msg.get('text') or '') for msg in reversed(messages))
+    return _keep_newest(messages, sizes, max_chars)
+
+def format_conversation(messages):
+    """Render messages as "User: ..." / "Assistant: ..." lines for a prompt"""
+    return "\n".join([
+        f"{'User' if msg.get('sender') == 'user' else 'Assistant'}: {msg.get('text', '')}"
+        for msg in messages
+    ])
+
+def sse_event(payload):
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+def sse_response(events):
+    """Wrap an SSE event generator in an unbuffered streaming response"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def call_litellm(model, messages, system_prompt=None, temperature=0.7, max_tokens=2048, stream=False):
+    """
+    Call LiteLLM router with OpenAI-compatible API.
+    With stream=True the result carries a "stream" iterator of text deltas
+    instead of the full "response" text.
+    """
     try:
         # Build messages array
         openai_messages = []
@@ -53,15 +300,37 @@ def call_litellm(model, messages, system_prompt=None, temperature=0.7, max_token
         if system_prompt:
             openai_messages.append({"role": "system", "content": system_prompt})
 
-        openai_messages.extend(messages)
+        # Flatten Anthropic-style content blocks; cache_control only applies to Claude
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, list):
+                content = "".join(block["text"] for block in content)
+            openai_messages.append({"role": message["role"], "content": content})
 
-        # Call via LiteLLM
-        response = litellm_client.chat.completions.create(
-            model=model,
-            messages=openai_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        completion_params = {
+            "messages": openai_messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+
+        # Call via LiteLLM (coalesced with concurrent calls when batching is on)
+        if litellm_dispatcher:
+            response = litellm_dispatcher.submit(model, **completion_params).result()
+        else:
+            response = litellm_client.chat.completions.create(model=model, **completion_params)
+
+        if stream:
+            def deltas():
+                for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+            return {
+                "stream": deltas(),
+                "model": model,
+                "backend": "litellm"
+            }
 
         return {
             "response": response.choices[0].message.content,
@@ -69,11 +338,15 @@ def call_litellm(model, messages, system_prompt=None, temperature=0.7, max_token
             "backend": "litellm"
         }
     except Exception as e:
-        print(f"LiteLLM error: {e}")
+        app.logger.warning("LiteLLM error: %s", e)
         raise
 
-def call_anthropic_direct(model, messages, system_prompt=None, temperature=0.7, max_tokens=2048):
-    """Direct call to Anthropic API (fallback)"""
+def call_anthropic_direct(model, messages, system_prompt=None, temperature=0.7, max_tokens=2048, stream=False):
+    """
+    Direct call to Anthropic API (fallback).
+    With stream=True the result carries a "stream" iterator of text deltas
+    instead of the full "response" text.
+    """
     try:
         # Build API params
         api_params = {
@@ -84,15 +357,32 @@ def call_anthropic_direct(model, messages, system_prompt=None, temperature=0.7,
         }
 
         if system_prompt:
-            api_params["system"] = system_prompt
+            # Cacheable prefix: the system prompt is stable across a thread's turns
+            api_params["system"] = [
+                {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+            ]
+
+        if stream:
+            events = anthropic_client.messages.create(**api_params, stream=True)
+
+            def deltas():
+                for event in events:
+                    if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                        yield event.delta.text
+
+            return {
+                "stream": deltas(),
+                "model": model,
+                "backend": "anthropic-direct"
+            }
 
         # Call Anthropic
         message = anthropic_client.messages.create(**api_params)
 
         # Extract response
-        response_text = "".join(
-            block.text for block in message.content if isinstance(block, TextBlock)
-        )
+        response_text = "".join([
+            block.text for block in message.content if block.__class__ is _TextBlock
+        ])
 
         return {
             "response": response_text,
@@ -100,7 +390,7 @@ def call_anthropic_direct(model, messages, system_prompt=None, temperature=0.7,
             "backend": "anthropic-direct"
         }
     except Exception as e:
-        print(f"Anthropic error: {e}")
+        app.logger.warning("Anthropic error: %s", e)
         raise
 
 def create_topic_summary(parent_messages, selected_text, agent_type=None):
@@ -108,13 +398,18 @@ def create_topic_summary(parent_messages, selected_text, agent_type=None):
     if not parent_messages:
         return None
 
+    # Only the recent window is summarized (and keyed), bounding prompt size
+    parent_messages = parent_messages[-SUMMARY_MAX_MESSAGES:]
+
+    cache_key = SummaryCache.make_key(parent_messages, selected_text)
+    cached_summary = summary_cache.get(cache_key)
+    if cached_summary is not None:
+        return cached_summary
+
     # Use fast model for summaries
     agent_config = get_agent_config("fast")
 
-    conversation_context = "\n".join([
-        f"{'User' if msg.get('sender') == 'user' else 'Assistant'}: {msg.get('text', '')}"
-        for msg in parent_messages
-    ])
+    conversation_context = format_conversation(parent_messages)
 
     summary_prompt = f"""You are creating a stable summary of a conversation context for a topic thread.
 
@@ -136,61 +431,193 @@ Create a concise summary (2-3 sentences) that captures the essential context rel
                 temperature=0.5,
                 max_tokens=200
             )
-            return result["response"].strip()
         elif anthropic_client:
             result = call_anthropic_direct(
-                model="claude-3-haiku-20240307",
+                model=DEFAULT_FALLBACK_MODEL,
                 messages=messages,
                 temperature=0.5,
                 max_tokens=200
             )
-            return result["response"].strip()
+        else:
+            return None
+
+        summary = result["response"].strip()
+        if summary:
+            summary_cache.put(cache_key, summary)
+        return summary
     except Exception as e:
-        print(f"Error creating summary: {e}")
+        app.logger.warning("Error creating summary: %s", e)
         return None
 
+# ===================================
+# Intent Fast Path
+# ===================================
+
+# Whole-message patterns for turns that need no model at all
+INTENT_PATTERNS = [
+    ("greeting", re.compile(r"^\s*(hi|hello|hey|hiya|good (morning|afternoon|evening))( there)?[\s!.,]*$", re.I)),
+    ("thanks", re.compile(r"^\s*(thanks|thank you|thx|ty|cheers)( (so|very) much| a lot)?[\s!.,]*$", re.I)),
+    ("smalltalk", re.compile(r"^\s*(bye|goodbye|see you( later)?|good night|how are you( doing)?|how's it going)[\s!?.,]*$", re.I)),
+]
+
+CANNED_REPLIES = {
+    "greeting": "Hello! How can I help you today?",
+    "thanks": "You're welcome! Let me know if there's anything else I can help with.",
+    "smalltalk": "I'm here whenever you need me. What would you like to talk about?",
+}
+
+def classify(message):
+    """
+    Classify a user message into a cheap intent.
+    Returns a CANNED_REPLIES key, "simple" for short statements the fast tier
+    of the requested model family can handle, or None to leave routing to
+    the complexity score.
+    """
+    for intent, pattern in INTENT_PATTERNS:
+        if pattern.match(message):
+            return intent
+
+    if len(message.split()) < 6 and '?' not in message:
+        return "simple"
+
+    return None
+
+# ===================================
+# Complexity Routing
+# ===================================
+
+CODE_MARKERS = re.compile(r"```|^\s*(def|class|function|import|#include)\b|=>|[{};]\s*$", re.M)
+REASONING_MARKERS = re.compile(
+    r"\b(why|compare|contrast|analy[sz]e|evaluate|prove|derive|trade-?offs?|step by step|pros and cons)\b",
+    re.I
+)
+
+def complexity_score(message):
+    """
+    Score a message by length, code and reasoning cues. The length term grows
+    with log10 of the word count and is not capped, so long prose alone can
+    reach the balanced (10+ words) and powerful (~215+ words) tiers.
+    """
+    tokens = len(message.split())
+    length = math.log10(tokens) if tokens else 0.0
+    has_code = 1.0 if CODE_MARKERS.search(message) else 0.0
+    reasoning = 1.0 if REASONING_MARKERS.search(message) else 0.0
+    return 0.3 * length + 0.4 * has_code + 0.3 * reasoning
+
+def route_model(message, requested, fast=False):
+    """
+    Pick the tier of the requested model's family that fits the message.
+    Scores below 0.3 (or fast=True) go to the fast tier, above 0.7 to the
+    powerful tier, everything else to the balanced tier. A balanced or
+    powerful model the user picked is never scored down past the balanced
+    tier; only fast=True reaches its fast tier. Unknown models, such as
+    agent-coder, are returned as-is.
+    """
+    for tiers in MODEL_TIERS:
+        if requested in tiers:
+            if fast:
+                return tiers[0]
+            score = complexity_score(message)
+            if score > 0.7:
+                return tiers[2]
+            if score < 0.3 and requested == tiers[0]:
+                return tiers[0]
+            return tiers[1]
+    return requested
+
+def stream_chat_events(result, response_data):
+    """Yield the model's tokens as they arrive, then the response metadata"""
+    parts = []
+    try:
+        for text in result["stream"]:
+            parts.append(text)
+            yield sse_event({"type": "token", "text": text})
+    except Exception as e:
+        app.logger.exception("Streaming error")
+        yield sse_event({"type": "error", "error": str(e)})
+        return
+
+    response_data['response'] = "".join(parts)
+    yield sse_event({"type": "done", **response_data})
+
 # ===================================
 # API Routes
 # ===================================
 
+# The agent list never changes at runtime, so its response body is encoded once
+AGENTS_PAYLOAD = orjson.dumps({
+    'agents': list_agents(),
+    'default': DEFAULT_AGENT
+})
+
 @app.route('/api/agents', methods=['GET'])
 def get_agents():
     """List all available agents"""
-    return jsonify({
-        'agents': list_agents(),
-        'default': DEFAULT_AGENT
-    })
+    return app.response_class(AGENTS_PAYLOAD, mimetype='application/json')
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+@app.route('/api/chat', methods=['POST'], defaults={'stream_only': False})
+@app.route('/api/chat/stream', methods=['POST'], defaults={'stream_only': True})
+def chat(stream_only):
     try:
-        data = request.get_json(silent=True) or {}
+        data = read_json_body()
         user_message = data.get('message', '')
         context_pack = data.get('contextPack', None)
 
+        # Stream tokens back as Server-Sent Events on /api/chat/stream or when the client opts in
+        stream = stream_only or bool(data.get('stream'))
+
         # NEW: Get agent type from request (defaults to general)
         agent_type = data.get('agent', DEFAULT_AGENT)
+        if agent_type not in AGENTS:
+            agent_type = DEFAULT_AGENT
         agent_config = get_agent_config(agent_type)
 
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
 
+        # Answer trivial messages without a model call; short ones get the fast tier below
+        intent = classify(user_message)
+        if intent in CANNED_REPLIES:
+            result = {
+                "response": CANNED_REPLIES[intent],
+                "stream": iter([CANNED_REPLIES[intent]]),
+                "model": "canned",
+                "backend": "intent-fast-path"
+            }
+            response_data = {
+                'response': result["response"],
+                'model': result["model"],
+                'backend': result["backend"],
+                'agent': agent_type
+            }
+            if stream:
+                return sse_response(stream_chat_events(result, response_data))
+            return jsonify(response_data)
+
+        # Route to the model tier that fits the message, not just the agent's default;
+        # short statements go straight to the fast tier of the same family
+        model = route_model(user_message, agent_config["model"], fast=intent == "simple")
+
         # Build system prompt
-        system_prompt = agent_config["system_prompt"]
+        system_prompt = SYSTEM_PROMPTS[agent_type]
 
         # Build messages array
         messages = []
 
+        # Summary generated during this request (None if reused or not a topic thread)
+        computed_topic_summary = None
+
         # Handle topic thread context
         if context_pack and context_pack.get('isTopicThread'):
             selected_text = context_pack.get('selectedText', '')
-            parent_messages = context_pack.get('parentMessages', [])
+            parent_messages = decode_history(context_pack.get('parentMessages'))
             existing_summary = context_pack.get('topicSummary')
-            recent_turns = context_pack.get('recentTurns', [])
+            recent_turns = budget_turns(context_pack.get('recentTurns') or [])
 
             # Create or use existing topic summary
             if not existing_summary and parent_messages:
-                topic_summary = create_topic_summary(parent_messages, selected_text, agent_type)
+                computed_topic_summary = create_topic_summary(budget_messages(parent_messages), selected_text, agent_type)
+                topic_summary = computed_topic_summary
             else:
                 topic_summary = existing_summary
 
@@ -210,9 +637,15 @@ def chat():
                 working_memory = "\n\nRecent conversation (Working Memory):\n"
                 for i, turn in enumerate(recent_turns, 1):
                     working_memory += f"\nTurn {i}:\nUser: {turn.get('user', '')}\nAssistant: {turn.get('assistant', '')}\n"
-                user_message = working_memory + f"\nCurrent message:\n{user_message}"
+                # Not cacheable: the window of recent turns slides every turn, so a
+                # breakpoint here would pay the cache-write premium and never be read
+                messages.append({"role": "user", "content": [
+                    {"type": "text", "text": working_memory},
+                    {"type": "text", "text": f"\nCurrent message:\n{user_message}"},
+                ]})
 
-        messages.append({"role": "user", "content": user_message})
+        if not messages:
+            messages.append({"role": "user", "content": user_message})
 
         # Call appropriate LLM backend
         result = None
@@ -221,60 +654,62 @@ def chat():
         if litellm_client:
             try:
                 result = call_litellm(
-                    model=agent_config["model"],
+                    model=model,
                     messages=messages,
                     system_prompt=system_prompt,
                     temperature=agent_config["temperature"],
-                    max_tokens=agent_config["max_tokens"]
+                    max_tokens=agent_config["max_tokens"],
+                    stream=stream
                 )
             except Exception as e:
-                print(f"LiteLLM failed, trying direct Anthropic: {e}")
+                app.logger.warning("LiteLLM failed, trying direct Anthropic: %s", e)
                 # Fallback to direct Anthropic if LiteLLM fails
-                if anthropic_client and "claude" in agent_config["model"]:
+                if anthropic_client and "claude" in model:
                     result = call_anthropic_direct(
-                        model="claude-3-haiku-20240307",
+                        model=DEFAULT_FALLBACK_MODEL,
                         messages=messages,
                         system_prompt=system_prompt,
                         temperature=agent_config["temperature"],
-                        max_tokens=agent_config["max_tokens"]
+                        max_tokens=agent_config["max_tokens"],
+                        stream=stream
                     )
         # Direct Anthropic if LiteLLM not available
         elif anthropic_client:
             result = call_anthropic_direct(
-                model="claude-3-haiku-20240307",
+                model=DEFAULT_FALLBACK_MODEL,
                 messages=messages,
                 system_prompt=system_prompt,
                 temperature=agent_config["temperature"],
-                max_tokens=agent_config["max_tokens"]
+                max_tokens=agent_config["max_tokens"],
+                stream=stream
             )
 
         if not result:
             return jsonify({'error': 'No LLM backend available'}), 500
 
         response_data = {
-            'response': result["response"],
+            'response': result.get("response", ""),
             'model': result["model"],
             'backend': result.get("backend", "unknown"),
             'agent': agent_type
         }
 
+        if model != agent_config["model"]:
+            response_data['routedFrom'] = agent_config["model"]
+
         # Include topic summary if needed
-        if context_pack and context_pack.get('isTopicThread'):
-            parent_messages = context_pack.get('parentMessages', [])
-            selected_text = context_pack.get('selectedText', '')
-            existing_summary = context_pack.get('topicSummary')
+        if computed_topic_summary:
+            response_data['topicSummary'] = computed_topic_summary
 
-            if not existing_summary and parent_messages:
-                topic_summary = create_topic_summary(parent_messages, selected_text, agent_type)
-                if topic_summary:
-                    response_data['topicSummary'] = topic_summary
+        if stream:
+            return sse_response(stream_chat_events(result, response_data))
 
         return jsonify(response_data)
 
+    except InvalidHistory as e:
+        return jsonify({'error': f'Malformed message history: {e}'}), 400
     except Exception as e:
-        print(f"Unexpected error: {e}")
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("chat handler failed")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/health', methods=['GET'])
@@ -296,6 +731,8 @@ if __name__ == '__main__':
 
     print("\n🚀 Server starting on http://localhost:5001")
     print("📝 Available agents:", len(list_agents()))
+    print("ℹ️  Development server only. For production, from docker/ run:")
+    print("   gunicorn -k gevent -w $(nproc) --worker-connections 1000 -b 0.0.0.0:5001 wsgi:app")
     print("\n")
 
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    app.run(debug=DEBUG, host='0.0.0.0', port=5001)
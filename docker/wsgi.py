@@ -0,0 +1,15 @@
+"""
+WSGI entry point for serving server_llm with gunicorn and gevent workers.
+
+Run from the docker/ directory:
+    gunicorn -k gevent -w $(nproc) --worker-connections 1000 -b 0.0.0.0:5001 wsgi:app
+
+gevent must patch sockets, ssl and threading before the LLM SDKs (httpx)
+are imported, so the patch happens here, ahead of the app import.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+from server_llm import app  # noqa: E402
@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for server.py.
+
+Run from the repository root:
+    gunicorn -c gunicorn.conf.py server:app_wsgi
+
+Chat requests spend almost all their time waiting on Claude/Gemini, so gevent
+workers let many of them overlap inside each process.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+# app_wsgi answers /health without entering Flask
+wsgi_app = "server:app_wsgi"
+bind = "0.0.0.0:5001"
+worker_class = "gevent"
+workers = 2
+worker_connections = 1000
+
+# Topic summaries finish in the background and clients poll for them; with
+# several workers the poll can land on a different one, so share the summary
+# cache through SQLite unless .env or the environment already picks a path.
+# The file lives in the app's own instance/ directory (created 0700, file 0600),
+# not a shared temp dir, since it holds summaries of private conversations
+load_dotenv()
+if workers > 1:
+    os.environ.setdefault(
+        "SUMMARY_CACHE_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "topic_summaries.db")
+    )
+
+# Import the app once in the master and fork workers from it; LLM clients are
+# created lazily in each worker, so no connection pool crosses the fork
+preload_app = True
+
+def post_fork(server, worker):
+    # Threads don't survive the fork from the preloaded master; restart the log writer
+    from server import start_log_listener
+    start_log_listener()
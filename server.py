@@ -2,97 +2,370 @@
 """
 Flask server with extensible agentic system
 Supports multiple AI agents that can run in parallel or sequentially
+
+Serve with gunicorn and gevent workers (settings in gunicorn.conf.py):
+    gunicorn -c gunicorn.conf.py server:app_wsgi
 """
 
-from flask import Flask, request, jsonify
+# gevent must patch sockets, ssl and threading before the SDKs are imported
+from gevent import monkey
+monkey.patch_all()
+
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask.logging import default_handler
 from flask_cors import CORS
 import anthropic
 from anthropic.types import TextBlock
 import google.generativeai as genai
+import httpx
 import os
+import re
+import json
+import hashlib
+import orjson
+import threading
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import time
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
 from dotenv import load_dotenv
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Dict, List, Any, Iterator, Optional, Tuple
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Werkzeug debugger/reloader only when explicitly requested
+DEBUG = os.environ.get("FLASK_DEBUG") == "1"
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson; responses are encoded straight to bytes"""
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)  # Enable CORS for local development
 
-# Initialize Claude client
+# Request handlers only enqueue log records; a listener thread does the writing
+log_queue = queue.Queue(-1)
+app.logger.removeHandler(default_handler)
+app.logger.addHandler(QueueHandler(log_queue))
+app.logger.propagate = False
+_log_listener = None
+_log_listener_pid = None
+
+def start_log_listener() -> None:
+    """Start the thread that drains log_queue, once per process (gunicorn calls it after fork)"""
+    global _log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    _log_listener = QueueListener(log_queue, logging.StreamHandler())
+    _log_listener.start()
+    _log_listener_pid = os.getpid()
+
+start_log_listener()
+
+# Clients are built on first use in each process, not at import: with
+# gunicorn's preload_app the import runs in the master, and an open
+# connection pool must never be shared across forked workers.
+
+# Claude client
 # Get your API key from: https://console.anthropic.com/
-client = anthropic.Anthropic(
-    api_key=os.environ.get("ANTHROPIC_API_KEY")
-)
-
-# Initialize Gemini client
+def _get_client() -> anthropic.Anthropic:
+    return _client_for_process(os.getpid())
+
+@lru_cache(maxsize=1)
+def _client_for_process(pid: int) -> anthropic.Anthropic:
+    # Shared pooled HTTP/2 client: concurrent calls multiplex over warm connections
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=httpx.Timeout(60.0, connect=5.0)
+    )
+    return anthropic.Anthropic(
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        http_client=http_client
+    )
+
+# Gemini client
 # Get your API key from: https://aistudio.google.com/app/apikey
 google_api_key = os.environ.get("GOOGLE_API_KEY")
-gemini_model = None
-if google_api_key:
-    genai.configure(api_key=google_api_key)
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+
+def _get_gemini_model() -> Optional[genai.GenerativeModel]:
+    return _gemini_model_for_process(os.getpid()) if google_api_key else None
+
+@lru_cache(maxsize=1)
+def _gemini_model_for_process(pid: int) -> genai.GenerativeModel:
+    # REST transport goes through patched sockets; the default gRPC channel blocks the gevent hub
+    genai.configure(api_key=google_api_key, transport="rest")
+    return genai.GenerativeModel('gemini-1.5-flash')
 
 # Thread pool for parallel agent execution
 executor = ThreadPoolExecutor(max_workers=5)
+# Background topic summaries get their own, larger pool: each one waits on the
+# batching window plus a Claude call and must not starve agents of slots
+summary_executor = ThreadPoolExecutor(max_workers=64)
+
+def _extract_text(blocks, _T=TextBlock) -> str:
+    """Join the text of a response's text blocks, skipping tool use and other block types"""
+    # No tools are in use, so a reply is almost always a single text block
+    if len(blocks) == 1:
+        return blocks[0].text if blocks[0].__class__ is _T else ""
+    # Exact-class identity check skips isinstance's MRO walk; _T is bound at definition
+    return "".join([b.text for b in blocks if b.__class__ is _T])
+
+# One stripped, non-empty line per match
+_LINE_RE = re.compile(r'^\s*(.+?)\s*$', re.M)
+
+# Agents need a few turns of context before their output is worth a model call
+MIN_AGENT_MESSAGES = 4
+
+# Request size limits; larger requests are rejected with a 400
+MAX_MESSAGE_CHARS = 50_000
+MAX_RECENT_TURNS = 10
+# Longer parent histories are trimmed from the middle instead (only the oldest
+# and newest few messages are ever read)
+MAX_PARENT_MESSAGES = 500
+
+# Most recent parent messages fed to the topic summarizer (clients may ask for
+# a different span, up to SUMMARY_MAX_SPAN)
+SUMMARY_MAX_MESSAGES = 12
+SUMMARY_MAX_SPAN = 20
+# Oldest parent messages kept for grounding when the middle of a long parent is elided
+SUMMARY_HEAD_MESSAGES = 4
+SUMMARY_HEAD_MAX_CHARS = 2000
+# Parent messages shown verbatim while a new topic thread's summary is in flight
+STOPGAP_PARENT_MESSAGES = 4
+
+def read_json_body() -> Dict:
+    """
+    Parse the request body with orjson, reading the stream once without caching it.
+    Empty, malformed or non-object bodies give {}, like get_json(silent=True).
+    """
+    raw = request.get_data(cache=False)
+    if not raw:
+        return {}
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+class InvalidHistory(ValueError):
+    """A message history in the deduplicated encoding that doesn't decode"""
+
+def decode_history(payload: Any) -> List[Dict]:
+    """
+    Expand a message history sent in the deduplicated wire encoding
+    {"msgIndex": [unique messages], "msgSequence": [indexes into msgIndex]}.
+    Plain message lists are returned as-is. A malformed encoding raises InvalidHistory.
+    """
+    if isinstance(payload, dict) and 'msgIndex' in payload:
+        index = payload['msgIndex']
+        sequence = payload.get('msgSequence', [])
+        if not isinstance(index, list) or not isinstance(sequence, list):
+            raise InvalidHistory("msgIndex and msgSequence must be lists")
+        size = len(index)
+        if not all(type(i) is int and 0 <= i < size for i in sequence):
+            raise InvalidHistory("msgSequence entries must be indexes into msgIndex")
+        return [index[i] for i in sequence]
+    return payload or []
+
+# Character budgets (~4 chars per token) for context sent to the model
+RECENT_TURNS_MAX_CHARS = 8000
+PARENT_MESSAGES_MAX_CHARS = 6000
+
+def _keep_newest(items: List[Dict], sizes: Iterator[int], max_chars: int) -> List[Dict]:
+    """Keep the newest items whose sizes (given newest first) fit in max_chars; always keep one"""
+    kept = 0
+    used = 0
+    for size in sizes:
+        used += size
+        if used > max_chars and kept:
+            break
+        kept += 1
+    dropped = len(items) - kept
+    if dropped:
+        app.logger.debug("Dropped %d of %d items over the %d-char context budget", dropped, len(items), max_chars)
+    return items[dropped:]
+
+def budget_turns(turns: List[Dict], max_chars: int = RECENT_TURNS_MAX_CHARS) -> List[Dict]:
+    """Trim working-memory turns, oldest first, to a character budget"""
+    sizes = (len(turn.get('user') or '') + len(turn.get('assistant') or '') for turn in reversed(turns))
+    return _keep_newest(turns, sizes, max_chars)
+
+def budget_messages(messages: List[Dict], max_chars: int = PARENT_MESSAGES_MAX_CHARS) -> List[Dict]:
+    """Trim messages, oldest first, to a character budget"""
+    sizes = (len(msg.get('text') or '') for msg in reversed(messages))
+    return _keep_newest(messages, sizes, max_chars)
+
+def format_conversation(messages: List[Dict]) -> str:
+    """Render messages as "User: ..." / "Assistant: ..." lines for a prompt"""
+    return "\n".join([
+        f"{'User' if msg.get('sender') == 'user' else 'Assistant'}: {msg.get('text', '')}"
+        for msg in messages
+    ])
+
+@dataclass(slots=True)
+class TopicContext:
+    """Topic-thread fields of a contextPack, parsed once per request"""
+    selected_text: str
+    parent_messages: List[Dict]
+    existing_summary: Optional[str]
+    last_summarized_index: Optional[int]
+    span: int
+    recent_turns: List[Dict]
+    # Parent messages dropped from the middle of an overlong parent history
+    parent_offset: int = 0
+
+    @property
+    def parent_count(self) -> int:
+        """Length of the parent conversation as the client sent it"""
+        return len(self.parent_messages) + self.parent_offset
+
+    @classmethod
+    def from_context_pack(cls, context_pack: Optional[Dict]) -> Optional["TopicContext"]:
+        """None unless the context pack is for a topic thread"""
+        if not context_pack or not context_pack.get('isTopicThread'):
+            return None
+        last_summarized_index = context_pack.get('lastSummarizedIndex')
+        if type(last_summarized_index) is not int:
+            last_summarized_index = None
+
+        parent_messages = decode_history(context_pack.get('parentMessages'))
+        parent_offset = 0
+        if len(parent_messages) > MAX_PARENT_MESSAGES:
+            # Keep the grounding head and the newest messages; lastSummarizedIndex
+            # counts the full history, so shift it past the dropped middle
+            parent_offset = len(parent_messages) - MAX_PARENT_MESSAGES
+            parent_messages = (parent_messages[:SUMMARY_HEAD_MESSAGES]
+                               + parent_messages[SUMMARY_HEAD_MESSAGES + parent_offset:])
+            if last_summarized_index is not None and last_summarized_index >= SUMMARY_HEAD_MESSAGES:
+                last_summarized_index = max(SUMMARY_HEAD_MESSAGES, last_summarized_index - parent_offset)
+
+        return cls(
+            selected_text=context_pack.get('selectedText', ''),
+            parent_messages=parent_messages,
+            existing_summary=context_pack.get('topicSummary'),
+            last_summarized_index=last_summarized_index,
+            span=summary_span(context_pack),
+            recent_turns=context_pack.get('recentTurns') or [],
+            parent_offset=parent_offset,
+        )
 
 # ============================================================================
 # EXTENSIBLE AGENT SYSTEM
 # ============================================================================
 
+# Inline agents ask the main model to append their output after its answer,
+# wrapped in these tags, instead of making a separate LLM call
+BRANCH_IDEAS_OPEN = "<branch_ideas>"
+BRANCH_IDEAS_CLOSE = "</branch_ideas>"
+
+BRAINSTORMING_INLINE_PROMPT = f"""After your answer, on a new line, write {BRANCH_IDEAS_OPEN}, then 1-3 short (3-7 words), divergent topic titles that could branch off from this conversation, one per line with no numbering, then {BRANCH_IDEAS_CLOSE}. Never mention or explain this section."""
+
 class AgentRegistry:
     """
     Registry for all available agents.
     Add new agents here to extend the system's capabilities.
     """
 
+    # Built once; each config is a read-only view shared by every lookup
+    AGENTS = {
+        "brainstorming": MappingProxyType({
+            "name": "Brainstorming Agent",
+            "model": "claude-3-haiku-20240307",
+            "max_tokens": 300,
+            "temperature": 0.9,
+            "enabled": True,
+            # can be "parallel", "sequential" or "inline" (folded into the
+            # main completion; runs standalone only if that output is missing)
+            "execution": "inline",
+            "inline_prompt": BRAINSTORMING_INLINE_PROMPT,
+            "description": "Generates creative topic ideas from conversations"
+        }),
+        # Add more agents here in the future:
+        # "summarizer": {...},
+        # "fact_checker": {...},
+        # "code_reviewer": {...},
+    }
+
     @staticmethod
     def get_agent_config(agent_type: str) -> Optional[Dict]:
-        """Get configuration for a specific agent type"""
-        agents = {
-            "brainstorming": {
-                "name": "Brainstorming Agent",
-                "model": "claude-3-haiku-20240307",
-                "max_tokens": 300,
-                "temperature": 0.9,
-                "enabled": True,
-                "execution": "parallel",  # can be "parallel" or "sequential"
-                "description": "Generates creative topic ideas from conversations"
-            },
-            # Add more agents here in the future:
-            # "summarizer": {...},
-            # "fact_checker": {...},
-            # "code_reviewer": {...},
-        }
-        return agents.get(agent_type)
+        """Get configuration for a specific agent type (read-only)"""
+        return AgentRegistry.AGENTS.get(agent_type)
 
     @staticmethod
     def get_enabled_agents() -> List[str]:
         """Get list of all enabled agents"""
         return ["brainstorming"]  # Add more as they're implemented
 
+    @staticmethod
+    def get_inline_agents(enabled_agents: Optional[List[str]] = None) -> List[str]:
+        """Get the enabled agents whose output is folded into the main completion"""
+        if enabled_agents is None:
+            enabled_agents = AgentRegistry.get_enabled_agents()
+
+        inline_agents = []
+        for agent_type in enabled_agents:
+            config = AgentRegistry.get_agent_config(agent_type)
+            if config and config.get("enabled") and config.get("execution") == "inline":
+                inline_agents.append(agent_type)
+        return inline_agents
+
 
 class AgentExecutor:
     """
     Executes agents based on their configuration.
-    Supports both parallel and sequential execution.
+    Supports parallel, sequential and inline execution.
     """
 
+    @staticmethod
+    def parse_ideas(response_text: str) -> List[str]:
+        """Parse up to 3 topic ideas, one per line"""
+        return [
+            line for line in _LINE_RE.findall(response_text)
+            if len(line) > 3
+        ][:3]  # Maximum 3 ideas
+
     @staticmethod
     def execute_brainstorming_agent(messages: List[Dict], context: Optional[Dict] = None) -> Dict:
         """
         Brainstorming Agent: Generates 1-3 divergent, interesting topic ideas
         based on the conversation.
         """
+        if len(messages) < MIN_AGENT_MESSAGES:
+            return {
+                "success": True,
+                "ideas": [],
+                "agent": "brainstorming",
+                "skipped": True
+            }
+
         config = AgentRegistry.get_agent_config("brainstorming")
 
         # Build conversation context for the agent
-        conversation_text = "\n".join([
-            f"{'User' if msg.get('sender') == 'user' else 'Assistant'}: {msg.get('text', '')}"
-            for msg in messages[-6:]  # Last 3 turns (user + AI)
-        ])
+        conversation_text = format_conversation(messages[-6:])  # Last 3 turns (user + AI)
 
         prompt = f"""Based on this conversation, generate 1-3 short, divergent, interesting topic titles that could branch off from this discussion.
 
@@ -112,7 +385,7 @@ Ethical implications of AI
 Practical applications today"""
 
         try:
-            response = client.messages.create(
+            response = _get_client().messages.create(
                 model=config["model"],
                 max_tokens=config["max_tokens"],
                 temperature=config["temperature"],
@@ -120,17 +393,10 @@ Practical applications today"""
             )
 
             # Extract text
-            response_text = "".join(
-                block.text for block in response.content
-                if isinstance(block, TextBlock)
-            )
+            response_text = _extract_text(response.content)
 
             # Parse ideas (one per line)
-            ideas = [
-                line.strip()
-                for line in response_text.strip().split('\n')
-                if line.strip() and len(line.strip()) > 3
-            ][:3]  # Maximum 3 ideas
+            ideas = AgentExecutor.parse_ideas(response_text)
 
             return {
                 "success": True,
@@ -139,7 +405,7 @@ Practical applications today"""
             }
 
         except Exception as e:
-            print(f"Brainstorming agent error: {e}")
+            app.logger.error("Brainstorming agent error: %s", e)
             return {
                 "success": False,
                 "ideas": [],
@@ -148,18 +414,18 @@ Practical applications today"""
             }
 
     @staticmethod
-    def run_agents(messages: List[Dict], context: Optional[Dict] = None,
-                   enabled_agents: Optional[List[str]] = None) -> Dict[str, Any]:
+    def start_agents(messages: List[Dict], context: Optional[Dict] = None,
+                     enabled_agents: Optional[List[str]] = None) -> Dict[str, Future]:
         """
-        Execute all enabled agents in parallel or sequentially.
-        Returns a dictionary of agent results.
+        Submit all enabled parallel agents to the thread pool without waiting.
+        Lets the caller overlap agent work with the main model call.
+        Returns a dictionary of agent futures.
         """
         if enabled_agents is None:
             enabled_agents = AgentRegistry.get_enabled_agents()
 
-        results = {}
-
         # Separate parallel and sequential agents
+        # (inline agents ride along with the main completion instead)
         parallel_agents = []
         sequential_agents = []
 
@@ -168,93 +434,672 @@ Practical applications today"""
             if config and config.get("enabled"):
                 if config.get("execution") == "parallel":
                     parallel_agents.append(agent_type)
-                else:
+                elif config.get("execution") != "inline":
                     sequential_agents.append(agent_type)
 
         # Execute parallel agents
-        if parallel_agents:
-            futures = {}
-            for agent_type in parallel_agents:
-                if agent_type == "brainstorming":
-                    futures[agent_type] = executor.submit(
-                        AgentExecutor.execute_brainstorming_agent,
-                        messages,
-                        context
-                    )
-                # Add more agent types here as they're implemented
-
-            # Collect results
-            for agent_type, future in futures.items():
-                try:
-                    results[agent_type] = future.result(timeout=10)
-                except Exception as e:
-                    print(f"Agent {agent_type} failed: {e}")
-                    results[agent_type] = {
-                        "success": False,
-                        "error": str(e),
-                        "agent": agent_type
-                    }
+        futures = {}
+        for agent_type in parallel_agents:
+            if agent_type == "brainstorming":
+                futures[agent_type] = executor.submit(
+                    AgentExecutor.execute_brainstorming_agent,
+                    messages,
+                    context
+                )
+            # Add more agent types here as they're implemented
 
         # Execute sequential agents (for future use)
         for agent_type in sequential_agents:
             # Sequential execution would go here
             pass
 
+        return futures
+
+    @staticmethod
+    def collect_results(futures: Dict[str, Future], timeout: float = 10) -> Dict[str, Any]:
+        """
+        Wait for started agents to finish, sharing one timeout across all of them.
+        Returns a dictionary of agent results.
+        """
+        results = {}
+        if not futures:
+            return results
+
+        wait(futures.values(), timeout=timeout)
+
+        for agent_type, future in futures.items():
+            try:
+                # Futures still running here have used up the shared timeout
+                results[agent_type] = future.result(timeout=0)
+            except Exception as e:
+                app.logger.error("Agent %s failed: %s", agent_type, e)
+                results[agent_type] = {
+                    "success": False,
+                    "error": str(e) or "Agent timed out",
+                    "agent": agent_type
+                }
+
+        return results
+
+    @staticmethod
+    def build_inline_prompt(inline_agents: List[str], messages: List[Dict]) -> str:
+        """
+        System prompt instructions for the inline agents. The main call only sees
+        the current turn, so the recent conversation the standalone agent would
+        have read is included with them.
+        """
+        if not inline_agents:
+            return ""
+        instructions = "\n\n".join([
+            AgentRegistry.get_agent_config(agent_type)["inline_prompt"] for agent_type in inline_agents
+        ])
+        return f"{instructions}\n\nRecent conversation to draw on:\n{format_conversation(messages[-6:])}"
+
+    @staticmethod
+    def finish_inline_agents(trailer: str, inline_agents: List[str], messages: List[Dict],
+                             context: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        Turn the tagged trailer of the main completion into inline agent results.
+        Agents whose section is missing or empty fall back to a standalone call.
+        """
+        results = {}
+        fallback_futures = {}
+
+        for agent_type in inline_agents:
+            if agent_type == "brainstorming":
+                ideas = AgentExecutor.parse_ideas(trailer.split(BRANCH_IDEAS_CLOSE)[0])
+                if ideas:
+                    results[agent_type] = {
+                        "success": True,
+                        "ideas": ideas,
+                        "agent": "brainstorming"
+                    }
+                else:
+                    fallback_futures[agent_type] = executor.submit(
+                        AgentExecutor.execute_brainstorming_agent,
+                        messages,
+                        context
+                    )
+            # Add more inline agent types here as they're implemented
+
+        results.update(AgentExecutor.collect_results(fallback_futures))
         return results
 
+    @staticmethod
+    def run_agents(messages: List[Dict], context: Optional[Dict] = None,
+                   enabled_agents: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Execute all enabled agents in parallel or sequentially.
+        Returns a dictionary of agent results.
+        """
+        futures = AgentExecutor.start_agents(messages, context, enabled_agents)
+        return AgentExecutor.collect_results(futures)
+
 # ============================================================================
 # END AGENT SYSTEM
 # ============================================================================
 
-def create_topic_summary(parent_messages, selected_text):
-    """Create a stable summary of the parent conversation context for a topic thread."""
-    if not parent_messages:
-        return None
-    
+# ============================================================================
+# TOPIC SUMMARY CACHE
+# ============================================================================
+
+class SummaryCache:
+    """
+    LRU cache of topic summaries, optionally backed by a SQLite file.
+    Keyed by a hash of the selected text and parent messages, so a topic thread
+    reopened over the same context reuses its summary instead of calling Claude.
+    With a path, summaries also survive restarts and are shared between workers;
+    the file keeps only the max_rows most recently written summaries.
+    """
+
+    def __init__(self, maxsize: int = 512, path: Optional[str] = None, max_rows: int = 10000):
+        self.maxsize = maxsize
+        self.path = path
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+
+    @staticmethod
+    def make_key(parent_messages: List[Dict], selected_text: str,
+                 existing_summary: Optional[str] = None) -> str:
+        """Hash the summary inputs into a stable cache key"""
+        inputs = [selected_text, [(msg.get('sender'), msg.get('text')) for msg in parent_messages]]
+        if existing_summary:
+            inputs.append(existing_summary)
+        payload = json.dumps(inputs, sort_keys=True)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """Open the backing store lazily, once per process (never shared across a fork)"""
+        if not self.path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            if not os.path.exists(self.path):
+                # Summaries quote private conversations: owner-only file (SQLite gives
+                # its WAL and shm files the same mode) in an owner-only directory
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, mode=0o700, exist_ok=True)
+                os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+            # A short busy timeout: a contended write blocks the whole gevent worker
+            self._db = sqlite3.connect(self.path, timeout=0.5, check_same_thread=False)
+            # WAL lets every worker read while one of them writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS topic_summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL)"
+            )
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+                return summary
+
+            # A store error degrades to a miss rather than failing the request
+            try:
+                db = self._connection()
+                row = db and db.execute("SELECT summary FROM topic_summaries WHERE key = ?", (key,)).fetchone()
+            except (sqlite3.Error, OSError) as e:
+                app.logger.warning("Summary store read failed: %s", e)
+                return None
+            if row is None:
+                return None
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._remember(key, summary)
+            try:
+                db = self._connection()
+                if db is not None:
+                    db.execute("INSERT OR REPLACE INTO topic_summaries (key, summary) VALUES (?, ?)", (key, summary))
+                    # REPLACE gives the row a fresh rowid, so the lowest rowids are the oldest writes
+                    db.execute(
+                        "DELETE FROM topic_summaries WHERE rowid <= (SELECT MAX(rowid) FROM topic_summaries) - ?",
+                        (self.max_rows,)
+                    )
+                    db.commit()
+            except (sqlite3.Error, OSError) as e:
+                app.logger.warning("Summary store write failed: %s", e)
+
+    def _remember(self, key: str, summary: str) -> None:
+        self._entries[key] = summary
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# Set SUMMARY_CACHE_PATH to persist summaries in a SQLite file
+summary_cache = SummaryCache(maxsize=1024, path=os.environ.get("SUMMARY_CACHE_PATH"))
+
+def summary_span(context_pack: Dict) -> int:
+    """Number of recent parent messages to summarize, from contextPack.summarySpan"""
+    span = context_pack.get('summarySpan')
+    if type(span) is not int:
+        return SUMMARY_MAX_MESSAGES
+    return max(1, min(span, SUMMARY_MAX_SPAN))
+
+def summary_window(parent_messages: List[Dict], span: int = SUMMARY_MAX_MESSAGES,
+                   head: int = 0) -> Tuple[List[Dict], List[Dict], int]:
+    """
+    Split the parent messages a summary is built (and keyed) from into
+    (head, tail, omitted): up to `head` of the oldest messages for grounding,
+    the newest `span` messages within the character budget, and how many
+    messages between them are left out.
+    """
+    tail = budget_messages(parent_messages)[-span:]
+    omitted = len(parent_messages) - len(tail)
+    # Grounding wants the earliest messages, so the head keeps those that fit the budget
+    head_messages = []
+    used = 0
+    for msg in parent_messages[:min(head, omitted)]:
+        used += len(msg.get('text') or '')
+        if used > SUMMARY_HEAD_MAX_CHARS:
+            break
+        head_messages.append(msg)
+    return head_messages, tail, omitted - len(head_messages)
+
+def summary_inputs(parent_messages, selected_text, existing_summary=None,
+                   last_summarized_index=0, span=SUMMARY_MAX_MESSAGES) -> Tuple[List[Dict], List[Dict], int, str]:
+    """
+    The bounded window a summary is built from, as (head, tail, omitted, cache key):
+    the newest `span` messages, plus the oldest few for grounding unless an
+    existing summary already covers them.
+    """
+    if existing_summary:
+        head, tail, omitted = summary_window(parent_messages[last_summarized_index:], span)
+    else:
+        head, tail, omitted = summary_window(parent_messages, span, SUMMARY_HEAD_MESSAGES)
+    return head, tail, omitted, SummaryCache.make_key(head + tail, selected_text, existing_summary)
+
+# ============================================================================
+# TOPIC SUMMARY BATCHING
+# ============================================================================
+
+SUMMARY_MODEL = "claude-3-haiku-20240307"
+
+# Static instructions shared by every summary call, sent as a cacheable system block
+SUMMARIZER_INSTRUCTIONS = """You create stable summaries of a conversation context for topic threads. A topic thread is a side conversation the user opened from a passage they selected in a parent conversation.
+
+Each summary is concise (2-3 sentences) and captures the essential context from the parent conversation that is relevant to the selected topic. It serves as the "long-term memory" of the topic thread, so it must stand on its own without the parent conversation. When given a current summary and new messages, update the summary rather than starting over."""
+SUMMARIZER_SYSTEM = [
+    {"type": "text", "text": SUMMARIZER_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}}
+]
+# A 2-3 sentence summary fits well inside this; it only caps runaway output
+SUMMARY_MAX_TOKENS = 120
+
+def summarize_prompt(prompt: str) -> str:
+    """Run one summary prompt through Claude and return the stripped text"""
+    # Prefilling the opening tag skips any preamble, and the closing tag ends
+    # decoding as soon as the summary itself is done
+    summary_response = _get_client().messages.create(
+        model=SUMMARY_MODEL,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        system=SUMMARIZER_SYSTEM,
+        stop_sequences=["</summary>"],
+        messages=[
+            {"role": "user", "content": prompt + "\n\nWrite the summary inside <summary></summary> tags."},
+            {"role": "assistant", "content": "<summary>"}
+        ]
+    )
+    return _extract_text(summary_response.content).strip()
+
+class SummaryBatcher:
+    """
+    Coalesces topic summary prompts. Prompts arriving within `window` seconds
+    of the first one (up to max_batch) go to Claude as a single request that
+    returns a JSON list of summaries, one per prompt. A lone prompt is sent
+    as-is, and a batch whose reply can't be parsed falls back to one call each.
+    """
+
+    def __init__(self, window: float = 0.075, max_batch: int = 8):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[queue.Queue] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str) -> Future:
+        """Queue a summary prompt; returns a Future for its summary text"""
+        future = Future()
+        self._queue_for_process().put((prompt, future))
+        return future
+
+    def _queue_for_process(self) -> queue.Queue:
+        # The drain thread starts on first use in each worker; threads don't survive a fork
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._drain, args=(self._queue,), daemon=True).start()
+            return self._queue
+
+    def _drain(self, pending: queue.Queue):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Call off the drain thread so the next window can open meanwhile
+            threading.Thread(target=self._run, args=(batch,), daemon=True).start()
+
+    def _run(self, batch: List[tuple]):
+        batch = [(prompt, future) for prompt, future in batch if future.set_running_or_notify_cancel()]
+        if len(batch) > 1:
+            try:
+                summaries = self._summarize_batch([prompt for prompt, _ in batch])
+            except Exception as e:
+                app.logger.warning("Batched topic summary failed, retrying individually: %s", e)
+                summaries = None
+            if summaries is not None:
+                for (_, future), summary in zip(batch, summaries):
+                    future.set_result(summary)
+                return
+
+        for prompt, future in batch:
+            threading.Thread(target=self._run_one, args=(prompt, future), daemon=True).start()
+
+    @staticmethod
+    def _run_one(prompt: str, future: Future):
+        try:
+            future.set_result(summarize_prompt(prompt))
+        except Exception as e:
+            future.set_exception(e)
+
+    @staticmethod
+    def _summarize_batch(prompts: List[str]) -> Optional[List[str]]:
+        """One Claude call for several prompts; None if the reply isn't a matching JSON list"""
+        sections = "\n\n".join(
+            f"<request index=\"{i}\">\n{prompt}\n</request>" for i, prompt in enumerate(prompts)
+        )
+        batch_prompt = f"""Below are {len(prompts)} independent summarization requests. Answer each one separately, as if it were the only request.
+
+{sections}
+
+Return only a JSON list of {len(prompts)} strings, where item i is the answer to request i."""
+        summary_response = _get_client().messages.create(
+            model=SUMMARY_MODEL,
+            max_tokens=SUMMARY_MAX_TOKENS * len(prompts),
+            system=SUMMARIZER_SYSTEM,
+            messages=[{"role": "user", "content": batch_prompt}]
+        )
+        text = _extract_text(summary_response.content)
+        try:
+            summaries = json.loads(text[text.index("["):text.rindex("]") + 1])
+        except ValueError:
+            return None
+        if len(summaries) != len(prompts) or not all(isinstance(summary, str) for summary in summaries):
+            return None
+        return [summary.strip() for summary in summaries]
+
+# Off unless SUMMARY_BATCH_WINDOW_MS is set: a batch puts unrelated threads'
+# conversations in one prompt and adds up to the window in latency, which only
+# pays off under heavy concurrent load
+summary_batcher = None
+summary_batch_window_ms = float(os.environ.get("SUMMARY_BATCH_WINDOW_MS", "0"))
+if summary_batch_window_ms > 0:
+    summary_batcher = SummaryBatcher(window=summary_batch_window_ms / 1000)
+
+def create_topic_summary(parent_messages, selected_text, existing_summary=None,
+                         last_summarized_index=0, span=SUMMARY_MAX_MESSAGES):
+    """
+    Create a stable summary of the parent conversation context for a topic thread.
+    With an existing summary, only the messages after last_summarized_index are
+    folded into it. Returns (summary, number of parent messages it covers).
+    """
+    summarized_count = len(parent_messages)
+    # Only a bounded window is summarized (and keyed), bounding prompt size
+    head, tail, omitted, cache_key = summary_inputs(
+        parent_messages, selected_text, existing_summary, last_summarized_index, span
+    )
+    if not tail:
+        return existing_summary, summarized_count
+
     # Format parent messages for summarization
-    conversation_context = "\n".join([
-        f"{'User' if msg.get('sender') == 'user' else 'Assistant'}: {msg.get('text', '')}"
-        for msg in parent_messages
-    ])
+    conversation_context = format_conversation(tail)
+    if omitted:
+        conversation_context = f"... [{omitted} messages omitted] ...\n" + conversation_context
+    if head:
+        conversation_context = format_conversation(head) + "\n" + conversation_context
     
-    summary_prompt = f"""You are creating a stable summary of a conversation context for a topic thread.
+    if existing_summary:
+        summary_prompt = f"""The user selected this text from the parent conversation:
+"{selected_text}"
+
+Current summary:
+{existing_summary}
 
-The user selected this text from the parent conversation:
+New messages in the parent conversation since that summary:
+{conversation_context}
+
+Update the summary with anything in the new messages relevant to the selected topic."""
+    else:
+        summary_prompt = f"""The user selected this text from the parent conversation:
 "{selected_text}"
 
 Parent conversation context:
 {conversation_context}
 
-Create a concise summary (2-3 sentences) that captures the essential context relevant to the selected topic. This summary will serve as "long-term memory" for the topic thread."""
+Summarize the context relevant to the selected topic."""
     
     try:
-        summary_response = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=200,
-            messages=[{"role": "user", "content": summary_prompt}]
-        )
-        summary_text = "".join(
-            block.text for block in summary_response.content 
-            if isinstance(block, TextBlock)
-        )
-        return summary_text.strip()
+        cached_summary = summary_cache.get(cache_key)
+        if cached_summary is not None:
+            return cached_summary, summarized_count
+
+        if summary_batcher:
+            summary_text = summary_batcher.submit(summary_prompt).result()
+        else:
+            summary_text = summarize_prompt(summary_prompt)
+        if summary_text:
+            summary_cache.put(cache_key, summary_text)
+        return summary_text, summarized_count
     except Exception as e:
-        print(f"Error creating topic summary: {e}")
-        return None
+        app.logger.error("Error creating topic summary: %s", e)
+        return None, summarized_count
+
+# Summaries currently being made in this process, keyed by summary cache key,
+# so turns sent before one finishes share it instead of calling Claude again
+_pending_summaries: Dict[str, Future] = {}
+# Recently failed summary keys, so polls can stop instead of waiting forever
+_failed_summaries: "OrderedDict[str, None]" = OrderedDict()
+_summaries_lock = threading.Lock()
+FAILED_SUMMARIES_MAX = 1024
+
+def submit_topic_summary(summary_id: str, *args, **kwargs) -> Future:
+    """Start create_topic_summary in the background, or join the run already in flight"""
+    with _summaries_lock:
+        future = _pending_summaries.get(summary_id)
+        if future is not None:
+            return future
+        _failed_summaries.pop(summary_id, None)
+        future = summary_executor.submit(create_topic_summary, *args, **kwargs)
+        _pending_summaries[summary_id] = future
+    future.add_done_callback(lambda done: _finish_topic_summary(summary_id, done))
+    return future
+
+def _finish_topic_summary(summary_id: str, future: Future) -> None:
+    try:
+        succeeded = bool(future.result()[0])
+    except Exception:
+        succeeded = False
+    with _summaries_lock:
+        _pending_summaries.pop(summary_id, None)
+        if not succeeded:
+            _failed_summaries[summary_id] = None
+            while len(_failed_summaries) > FAILED_SUMMARIES_MAX:
+                _failed_summaries.popitem(last=False)
+
+def topic_summary_failed(summary_id: str) -> bool:
+    with _summaries_lock:
+        return summary_id in _failed_summaries
+
+# ============================================================================
+# STREAMING HELPERS
+# ============================================================================
+
+def sse_event(payload: Dict) -> str:
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+def format_api_error(e: anthropic.APIError) -> str:
+    """Build a user-facing message for an Anthropic API error"""
+    error_msg = f"Anthropic API Error: {e.message}"
+    if "not_found_error" in str(e):
+        error_msg += "\n\nPossible causes:"
+        error_msg += "\n1. Model name is incorrect or deprecated"
+        error_msg += "\n2. Your API key doesn't have access to this model"
+        error_msg += "\n3. Check Anthropic console for available models"
+    return error_msg
+
+def stream_claude(api_params: Dict) -> Iterator[str]:
+    """
+    Start a streaming Claude completion and return an iterator of text deltas.
+    The request is sent before returning, so API errors raise here instead of
+    after the response headers have gone out.
+    """
+    events = _get_client().messages.create(**api_params, stream=True)
+
+    def deltas():
+        for event in events:
+            if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                yield event.delta.text
+
+    return deltas()
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+def stream_gemini(prompt: str) -> Iterator[str]:
+    """Start a streaming Gemini completion and return an iterator of text deltas"""
+    response = _get_gemini_model().generate_content(prompt, stream=True)
+
+    def deltas():
+        for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+
+    return deltas()
+
+def split_inline_stream(deltas: Iterator[str], trailer: List[str]) -> Iterator[str]:
+    """
+    Pass text deltas through until the inline-agent marker appears.
+    Everything after the marker is collected into trailer instead of being
+    yielded, and a chunk tail that may be the start of the marker is held back.
+    """
+    pending = ""
+    for text in deltas:
+        if trailer:
+            trailer.append(text)
+            continue
+
+        pending += text
+        marker_at = pending.find(BRANCH_IDEAS_OPEN)
+        if marker_at != -1:
+            if pending[:marker_at]:
+                yield pending[:marker_at]
+            trailer.append(pending[marker_at + len(BRANCH_IDEAS_OPEN):])
+            pending = ""
+            continue
+
+        held = 0
+        for size in range(min(len(BRANCH_IDEAS_OPEN) - 1, len(pending)), 0, -1):
+            if pending.endswith(BRANCH_IDEAS_OPEN[:size]):
+                held = size
+                break
+        if len(pending) > held:
+            yield pending[:len(pending) - held]
+            pending = pending[len(pending) - held:]
+
+    if pending:
+        yield pending
+
+def attach_topic_summary(response_data: Dict, summary: Optional[str], summarized_count: int) -> None:
+    """Return a newly made summary, and how many parent messages it covers, to the client"""
+    if summary:
+        response_data['topicSummary'] = summary
+        response_data['lastSummarizedIndex'] = summarized_count
+
+@dataclass(slots=True)
+class PendingSummary:
+    """A topic summary being made in the background for this request"""
+    future: Future
+    summary_id: str
+    summarized_count: int
+
+    def attach(self, response_data: Dict) -> None:
+        """
+        Attach the summary if it is ready. Otherwise never wait on it: the
+        client polls /api/topic/<summary_id>/summary, which reads the cache
+        the background task fills.
+        """
+        if self.future.done():
+            try:
+                # The count is this request's: a shared in-flight summary may
+                # have been started from a differently trimmed parent history
+                attach_topic_summary(response_data, self.future.result()[0], self.summarized_count)
+            except Exception as e:
+                # A failed summary must never fail the answer it rides along with
+                app.logger.error("Error creating topic summary: %s", e)
+        else:
+            response_data['topicSummaryPending'] = True
+            response_data['topicSummaryId'] = self.summary_id
+            response_data['lastSummarizedIndex'] = self.summarized_count
+
+def stream_chat_events(deltas: Iterator[str], response_data: Dict,
+                       agent_futures: Dict[str, Future], inline_agents: List[str],
+                       conversation_messages: List[Dict],
+                       context_pack: Optional[Dict],
+                       pending_summary: Optional[PendingSummary] = None) -> Iterator[str]:
+    """
+    Yield the main model's tokens as they arrive, then the response metadata
+    (with the topic summary if it has finished), then the agent results once
+    the background and inline agents have finished.
+    """
+    parts = []
+    trailer = []
+    if inline_agents:
+        deltas = split_inline_stream(deltas, trailer)
+    try:
+        for text in deltas:
+            parts.append(text)
+            yield sse_event({"type": "token", "text": text})
+    except anthropic.APIError as e:
+        app.logger.error("API Error: %s", e)
+        yield sse_event({"type": "error", "error": format_api_error(e)})
+        return
+    except Exception as e:
+        app.logger.exception("Unexpected error: %s", e)
+        yield sse_event({"type": "error", "error": str(e)})
+        return
+
+    response_data['response'] = "".join(parts).rstrip() if inline_agents else "".join(parts)
+    if pending_summary is not None:
+        pending_summary.attach(response_data)
+    yield sse_event({"type": "done", **response_data})
+
+    agent_results = AgentExecutor.collect_results(agent_futures)
+    if inline_agents:
+        agent_results.update(AgentExecutor.finish_inline_agents(
+            "".join(trailer), inline_agents, conversation_messages, context_pack
+        ))
+    if agent_results:
+        yield sse_event({"type": "agents", "agentResults": agent_results})
+
+@app.route('/api/chat', methods=['POST'], defaults={'stream_only': False})
+@app.route('/api/chat/stream', methods=['POST'], defaults={'stream_only': True})
+def chat(stream_only):
     try:
-        data = request.get_json(silent=True) or {}
+        data = read_json_body()
         user_message = data.get('message', '')
         context_pack = data.get('contextPack', None)
         # Allow frontend to control which agents to run
         enabled_agents = data.get('enabledAgents', None)
         # Model provider: 'claude' or 'gemini'
         model_provider = data.get('modelProvider', 'claude')
+        # Stream tokens back as Server-Sent Events on /api/chat/stream or when the client opts in
+        stream = stream_only or bool(data.get('stream'))
 
-        if not user_message:
+        # Reject empty and oversized input before it reaches a paid API
+        if not isinstance(user_message, str) or not user_message.strip():
             return jsonify({'error': 'No message provided'}), 400
+        if len(user_message) > MAX_MESSAGE_CHARS:
+            return jsonify({'error': f'Message is too long (max {MAX_MESSAGE_CHARS} characters)'}), 400
+
+        topic = TopicContext.from_context_pack(context_pack)
+        if topic:
+            if len(topic.recent_turns) > MAX_RECENT_TURNS:
+                return jsonify({'error': f'Too many recent turns (max {MAX_RECENT_TURNS})'}), 400
+
+        # ============================================================================
+        # RUN AGENTIC SYSTEM IN PARALLEL
+        # ============================================================================
+        # Start agents before the topic summary and main model call so their
+        # LLM round-trips overlap instead of running back to back.
+        # Get current conversation context (need to reconstruct from frontend data)
+        conversation_messages = decode_history(data.get('conversationMessages'))
+
+        agent_futures = {}
+        inline_agents = []
+        # Only run agents once the conversation has enough context to be useful
+        if conversation_messages and len(conversation_messages) >= MIN_AGENT_MESSAGES:
+            agent_futures = AgentExecutor.start_agents(
+                messages=conversation_messages,
+                context=context_pack,
+                enabled_agents=enabled_agents
+            )
+            inline_agents = AgentRegistry.get_inline_agents(enabled_agents)
 
         # Build system prompt
         system_prompt = "You are a helpful AI assistant."
@@ -262,23 +1107,63 @@ def chat():
         # Build messages array
         messages = []
 
+        # Summary generated during this request (None if reused or not a topic thread),
+        # and the number of parent messages it covers
+        computed_topic_summary = None
+        summarized_count = 0
+        pending_summary = None
+
+        # Claude message content; split into cacheable blocks for topic threads
+        user_content = user_message
+
         # Handle topic thread context
-        if context_pack and context_pack.get('isTopicThread'):
-            selected_text = context_pack.get('selectedText', '')
-            parent_messages = context_pack.get('parentMessages', [])
-            existing_summary = context_pack.get('topicSummary')
-            recent_turns = context_pack.get('recentTurns', [])
+        if topic:
+            selected_text = topic.selected_text
+            parent_messages = topic.parent_messages
+            recent_turns = budget_turns(topic.recent_turns)
 
             # Create or use existing topic summary
-            if not existing_summary and parent_messages:
-                topic_summary = create_topic_summary(parent_messages, selected_text)
-            else:
-                topic_summary = existing_summary
+            topic_summary = topic.existing_summary
+            if topic.existing_summary and topic.last_summarized_index is not None \
+                    and 0 <= topic.last_summarized_index < len(parent_messages):
+                # The parent grew since the summary was made: fold in only the new
+                # messages, alongside the main call, which still uses the old summary
+                summary_id = summary_inputs(
+                    parent_messages, selected_text,
+                    topic.existing_summary, topic.last_summarized_index, topic.span
+                )[3]
+                pending_summary = PendingSummary(
+                    submit_topic_summary(
+                        summary_id, parent_messages, selected_text,
+                        topic.existing_summary, topic.last_summarized_index, topic.span
+                    ),
+                    summary_id,
+                    topic.parent_count
+                )
+            elif not topic.existing_summary and parent_messages:
+                summary_id = summary_inputs(parent_messages, selected_text, span=topic.span)[3]
+                topic_summary = summary_cache.get(summary_id)
+                if topic_summary:
+                    computed_topic_summary = topic_summary
+                    summarized_count = topic.parent_count
+                else:
+                    # Summarize in the background instead of before the main call;
+                    # this turn answers from the parent tail as stopgap context
+                    pending_summary = PendingSummary(
+                        submit_topic_summary(summary_id, parent_messages, selected_text, span=topic.span),
+                        summary_id,
+                        topic.parent_count
+                    )
 
             # Build context for system prompt (long-term memory)
             context_parts = []
             if topic_summary:
                 context_parts.append(f"Topic Context (Long-term Memory):\n{topic_summary}")
+            elif pending_summary is not None:
+                context_parts.append(
+                    "Parent conversation (most recent messages):\n"
+                    + format_conversation(budget_messages(parent_messages[-STOPGAP_PARENT_MESSAGES:]))
+                )
 
             if selected_text:
                 context_parts.append(f"\nThis topic thread was created from this selection:\n\"{selected_text}\"")
@@ -288,32 +1173,51 @@ def chat():
 
             # Add recent turns as working memory (last 2-4 turns)
             if recent_turns:
-                working_memory = "\n\nRecent conversation (Working Memory):\n"
-                for i, turn in enumerate(recent_turns, 1):
-                    working_memory += f"\nTurn {i}:\nUser: {turn.get('user', '')}\nAssistant: {turn.get('assistant', '')}\n"
+                working_memory = "\n\nRecent conversation (Working Memory):\n" + "".join([
+                    f"\nTurn {i}:\nUser: {turn.get('user', '')}\nAssistant: {turn.get('assistant', '')}\n"
+                    for i, turn in enumerate(recent_turns, 1)
+                ])
                 # Prepend working memory to the user message
-                user_message = working_memory + f"\nCurrent message:\n{user_message}"
+                current_message = f"\nCurrent message:\n{user_message}"
+                user_message = working_memory + current_message
+                # Not cacheable: the window of recent turns slides every turn, so a
+                # breakpoint here would pay the cache-write premium and never be read
+                user_content = [
+                    {"type": "text", "text": working_memory},
+                    {"type": "text", "text": current_message},
+                ]
             else:
                 user_message = user_message
         else:
             user_message = user_message
 
-        messages.append({"role": "user", "content": user_message})
+        messages.append({"role": "user", "content": user_content})
+
+        # Inline agents: ask the main model to append their output after the answer.
+        # Kept apart from system_prompt: it carries the recent conversation, so it
+        # changes every turn and must stay out of the cached prefix
+        inline_prompt = AgentExecutor.build_inline_prompt(inline_agents, conversation_messages)
 
         # Route to appropriate model provider
         if model_provider == 'gemini':
             # Use Gemini API
-            if not gemini_model:
+            if not google_api_key:
                 return jsonify({'error': 'Gemini API key not configured. Add GOOGLE_API_KEY to your .env file.'}), 500
 
             # Build prompt with system context for Gemini
             gemini_prompt = user_message
-            if system_prompt != "You are a helpful AI assistant.":
+            if inline_prompt:
+                gemini_prompt = f"{system_prompt}\n\n{inline_prompt}\n\n{user_message}"
+            elif system_prompt != "You are a helpful AI assistant.":
                 gemini_prompt = f"{system_prompt}\n\n{user_message}"
 
-            gemini_response = gemini_model.generate_content(gemini_prompt)
-            response_text = gemini_response.text
             model_name = 'gemini-1.5-flash'
+            if stream:
+                deltas = stream_gemini(gemini_prompt)
+                response_text = ""
+            else:
+                gemini_response = _get_gemini_model().generate_content(gemini_prompt)
+                response_text = gemini_response.text
         else:
             # Use Claude API (default)
             # Use a stable, widely available model
@@ -328,17 +1232,25 @@ def chat():
             }
 
             # Only add system prompt if it's been customized
-            if system_prompt != "You are a helpful AI assistant.":
-                api_params["system"] = system_prompt
-
-            message = client.messages.create(**api_params)
+            # Marked cacheable: it is identical for every turn of a topic thread
+            if system_prompt != "You are a helpful AI assistant." or inline_prompt:
+                api_params["system"] = [
+                    {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+                ]
+                if inline_prompt:
+                    api_params["system"].append({"type": "text", "text": inline_prompt})
+
+            if stream:
+                deltas = stream_claude(api_params)
+                response_text = ""
+                model_name = api_params["model"]
+            else:
+                message = _get_client().messages.create(**api_params)
 
-            # Extract response text
-            # Combine only text blocks to avoid type errors on other block types
-            response_text = "".join(
-                block.text for block in message.content if isinstance(block, TextBlock)
-            )
-            model_name = message.model
+                # Extract response text
+                # Combine only text blocks to avoid type errors on other block types
+                response_text = _extract_text(message.content)
+                model_name = message.model
 
         response_data = {
             'response': response_text,
@@ -346,54 +1258,78 @@ def chat():
         }
 
         # Include topic summary if this is a topic thread and we created one
-        if context_pack and context_pack.get('isTopicThread'):
-            parent_messages = context_pack.get('parentMessages', [])
-            selected_text = context_pack.get('selectedText', '')
-            existing_summary = context_pack.get('topicSummary')
-
-            if not existing_summary and parent_messages:
-                topic_summary = create_topic_summary(parent_messages, selected_text)
-                if topic_summary:
-                    response_data['topicSummary'] = topic_summary
+        attach_topic_summary(response_data, computed_topic_summary, summarized_count)
+
+        if stream:
+            # Tokens go out as they arrive; agent results follow as a trailing event
+            return Response(
+                stream_with_context(stream_chat_events(
+                    deltas, response_data, agent_futures,
+                    inline_agents, conversation_messages, context_pack,
+                    pending_summary
+                )),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
 
-        # ============================================================================
-        # RUN AGENTIC SYSTEM IN PARALLEL
-        # ============================================================================
-        # Get current conversation context (need to reconstruct from frontend data)
-        conversation_messages = data.get('conversationMessages', [])
+        # Collect agent results started alongside the main model call
+        agent_results = AgentExecutor.collect_results(agent_futures)
+        if inline_agents:
+            answer, _, trailer = response_data['response'].partition(BRANCH_IDEAS_OPEN)
+            response_data['response'] = answer.rstrip()
+            agent_results.update(AgentExecutor.finish_inline_agents(
+                trailer, inline_agents, conversation_messages, context_pack
+            ))
 
-        # Only run agents if we have conversation context
-        if conversation_messages and len(conversation_messages) > 0:
-            agent_results = AgentExecutor.run_agents(
-                messages=conversation_messages,
-                context=context_pack,
-                enabled_agents=enabled_agents
-            )
+        # Add agent results to response
+        if agent_results:
+            response_data['agentResults'] = agent_results
 
-            # Add agent results to response
-            if agent_results:
-                response_data['agentResults'] = agent_results
+        # The summary ran alongside the main call; attach it now or tell the client to poll
+        if pending_summary is not None:
+            pending_summary.attach(response_data)
 
         return jsonify(response_data)
 
     except anthropic.APIError as e:
         # Handle Anthropic API specific errors
-        error_msg = f"Anthropic API Error: {e.message}"
-        if "not_found_error" in str(e):
-            error_msg += "\n\nPossible causes:"
-            error_msg += "\n1. Model name is incorrect or deprecated"
-            error_msg += "\n2. Your API key doesn't have access to this model"
-            error_msg += "\n3. Check Anthropic console for available models"
-        print(f"API Error: {e}")  # Log to server console
+        error_msg = format_api_error(e)
+        app.logger.error("API Error: %s", e)
         return jsonify({'error': error_msg}), 500
+    except InvalidHistory as e:
+        return jsonify({'error': f'Malformed message history: {e}'}), 400
     except Exception as e:
-        print(f"Unexpected error: {e}")  # Log to server console
+        app.logger.exception("Unexpected error: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/topic/<summary_id>/summary', methods=['GET'])
+def topic_summary(summary_id):
+    """Poll for a topic summary that a chat response reported as pending"""
+    summary = summary_cache.get(summary_id)
+    if summary:
+        return jsonify({'topicSummary': summary})
+    if topic_summary_failed(summary_id):
+        return jsonify({'error': 'Topic summary could not be generated'}), 404
+    # Still running here, or on another worker sharing SUMMARY_CACHE_PATH
+    return jsonify({'topicSummaryPending': True}), 202
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'status': 'ok'})
 
+_HEALTH_BODY = b'{"status":"ok"}'
+_HEALTH_HEADERS = [('Content-Type', 'application/json'), ('Content-Length', str(len(_HEALTH_BODY)))]
+
+def app_wsgi(environ, start_response):
+    """
+    WSGI entry point for gunicorn. Answers liveness probes on /health directly,
+    skipping Flask's request lifecycle and CORS, and hands everything else to the app.
+    """
+    if environ.get('PATH_INFO') == '/health' and environ.get('REQUEST_METHOD') == 'GET':
+        start_response('200 OK', _HEALTH_HEADERS)
+        return [_HEALTH_BODY]
+    return app(environ, start_response)
+
 if __name__ == '__main__':
     # Check if API keys are set
     print("\n--- API Key Status ---")
@@ -409,7 +1345,13 @@ if __name__ == '__main__':
     else:
         print("✅ Google API key loaded (Gemini models available)")
 
-    print("\n🚀 Server starting on http://localhost:5001")
-    print("ℹ️  Note: Using port 5001 to avoid macOS AirPlay conflict on port 5000\n")
+    print("ℹ️  Note: Using port 5001 to avoid macOS AirPlay conflict on port 5000")
 
-    app.run(debug=True, port=5001)
+    if not DEBUG:
+        # The Werkzeug dev server handles one request at a time; serve with gunicorn instead
+        print("\n🚀 Start the server with:")
+        print("   gunicorn -c gunicorn.conf.py server:app_wsgi\n")
+        print("   (or set FLASK_DEBUG=1 to run the Werkzeug debug server)\n")
+    else:
+        print("\n🚀 Debug server starting on http://localhost:5001\n")
+        app.run(debug=DEBUG, port=5001)
@@ -10,6 +10,58 @@ import './App.css'
 // localStorage keys
 const STORAGE_KEY_POSITIONS = 'nodeMap.manualPositions.v1'
 
+/**
+ * Read a text/event-stream response body and pass each JSON event to onEvent.
+ * EventSource only supports GET, so the POST /api/chat/stream body is parsed by hand.
+ */
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      const payload = frame
+        .split('\n')
+        .filter((line) => line.startsWith('data:'))
+        .map((line) => line.slice(5).trimStart())
+        .join('\n')
+      if (payload) onEvent(JSON.parse(payload))
+    }
+  }
+}
+
+const SUMMARY_POLL_INTERVAL_MS = 1500
+const SUMMARY_POLL_ATTEMPTS = 10
+
+/**
+ * Poll for a topic summary the server is still generating in the background.
+ * Resolves to the summary, or null if it isn't ready after SUMMARY_POLL_ATTEMPTS.
+ */
+async function pollTopicSummary(summaryId) {
+  for (let attempt = 0; attempt < SUMMARY_POLL_ATTEMPTS; attempt++) {
+    await new Promise((resolve) => setTimeout(resolve, SUMMARY_POLL_INTERVAL_MS))
+    try {
+      const response = await fetch(`/api/topic/${encodeURIComponent(summaryId)}/summary`)
+      if (response.status === 200) {
+        const data = await response.json()
+        return data.topicSummary || null
+      }
+      if (response.status !== 202) return null
+    } catch (error) {
+      console.error('Error polling topic summary:', error)
+    }
+  }
+  return null
+}
+
 /**
  * Main App with Split View (Chat + Map Panel)
  *
@@ -36,6 +88,8 @@ function App() {
   const [topicEdges, setTopicEdges] = useState([])
   // Topic summaries: { [conversationId]: summary }
   const [topicSummaries, setTopicSummaries] = useState({})
+  // Parent messages each summary covers: { [conversationId]: count }
+  const [summarizedCounts, setSummarizedCounts] = useState({})
 
   // Manual node positions: { [rootId]: { [nodeId]: { nx, ny } } }
   // Normalized coordinates (0-1) for resize stability
@@ -223,6 +277,8 @@ function App() {
       selectionRange: edge.selectionRange,
       parentMessages: parentConversation.messages,
       topicSummary: topicSummaries[conversationId] || null,
+      // Lets the server fold only newer parent messages into the summary
+      lastSummarizedIndex: summarizedCounts[conversationId] ?? null,
       recentTurns,
     }
   }
@@ -264,7 +320,7 @@ function App() {
       : [userMessage]
 
     try {
-      const response = await fetch('/api/chat', {
+      const response = await fetch('/api/chat/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -276,34 +332,79 @@ function App() {
         }),
       })
 
-      const data = await response.json()
-      setIsTyping(false)
-
-      const aiMessage = data?.error
-        ? { id: Date.now() + 1, text: `Error: ${data.error}`, sender: 'ai' }
-        : { id: Date.now() + 1, text: data.response, sender: 'ai' }
-
-      setConversations((prev) =>
-        prev.map((conv) =>
-          conv.id === activeConversationId
-            ? { ...conv, messages: [...conv.messages, aiMessage] }
-            : conv
+      // Insert the AI message on first write, then update it in place
+      const aiMessageId = Date.now() + 1
+      const setAiMessageText = (text) => {
+        setConversations((prev) =>
+          prev.map((conv) => {
+            if (conv.id !== activeConversationId) return conv
+            const exists = conv.messages.some((m) => m.id === aiMessageId)
+            const messages = exists
+              ? conv.messages.map((m) => (m.id === aiMessageId ? { ...m, text } : m))
+              : [...conv.messages, { id: aiMessageId, text, sender: 'ai' }]
+            return { ...conv, messages }
+          })
         )
-      )
+      }
 
-      if (data?.topicSummary && contextPack?.isTopicThread) {
+      const storeTopicSummary = (summary, summarizedCount) => {
         setTopicSummaries((prev) => ({
           ...prev,
-          [activeConversationId]: data.topicSummary,
+          [activeConversationId]: summary,
         }))
+        if (Number.isInteger(summarizedCount)) {
+          setSummarizedCounts((prev) => ({
+            ...prev,
+            [activeConversationId]: summarizedCount,
+          }))
+        }
       }
 
-      // ============================================================================
-      // HANDLE AGENT RESULTS - EXTENSIBLE SYSTEM
-      // ============================================================================
-      if (data?.agentResults) {
-        handleAgentResults(data.agentResults, activeConversationId)
+      const handleTopicSummary = (data) => {
+        if (!contextPack?.isTopicThread) return
+        if (data?.topicSummary) {
+          storeTopicSummary(data.topicSummary, data.lastSummarizedIndex)
+        } else if (data?.topicSummaryPending && data.topicSummaryId) {
+          // The answer didn't wait for the summary; fetch it once it's ready
+          pollTopicSummary(data.topicSummaryId).then((summary) => {
+            if (summary) storeTopicSummary(summary, data.lastSummarizedIndex)
+          })
+        }
+      }
+
+      // Errors raised before streaming starts still come back as plain JSON
+      if (!response.headers.get('content-type')?.includes('text/event-stream')) {
+        const data = await response.json()
+        setIsTyping(false)
+        setAiMessageText(data?.error ? `Error: ${data.error}` : data.response)
+        handleTopicSummary(data)
+        if (data?.agentResults) {
+          handleAgentResults(data.agentResults, activeConversationId)
+        }
+        return
       }
+
+      let streamedText = ''
+      await readEventStream(response, (event) => {
+        if (event.type === 'token') {
+          streamedText += event.text
+          setIsTyping(false)
+          setAiMessageText(streamedText)
+        } else if (event.type === 'done') {
+          setIsTyping(false)
+          setAiMessageText(event.response)
+          handleTopicSummary(event)
+        } else if (event.type === 'agents') {
+          // ============================================================================
+          // HANDLE AGENT RESULTS - EXTENSIBLE SYSTEM
+          // ============================================================================
+          handleAgentResults(event.agentResults, activeConversationId)
+        } else if (event.type === 'error') {
+          setIsTyping(false)
+          setAiMessageText(`Error: ${event.error}`)
+        }
+      })
+      setIsTyping(false)
     } catch (error) {
       setIsTyping(false)
       const errMsg = {